@@ -0,0 +1,109 @@
+import os
+import threading
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+from langchain_core.embeddings import Embeddings
+
+# Constants
+SOURCE_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_MODEL_DIR = "onnx_minilm_int8"
+ONNX_MODEL_FILE = "model_quantized.onnx"
+MAX_SEQ_LENGTH = 256  # Same truncation as the SentenceTransformer model
+
+class OnnxEmbeddings(Embeddings):
+    """MiniLM embeddings computed by an INT8-quantized ONNX Runtime model on CPU"""
+    
+    def __init__(self, model_dir=ONNX_MODEL_DIR, batch_size=64, num_threads=None):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        
+        # Fast tokenizers raise "Already borrowed" when called concurrently with
+        # padding/truncation
+        self._tokenizer_lock = threading.Lock()
+        
+        # Size the thread pool to the cores this process may use (all of them by default)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count()
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        
+        # Warm up once so the first real query does not pay for allocations
+        self.embed_query("warmup")
+    
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Tokenize, run the model, mean-pool and L2-normalize a batch of texts"""
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np"
+            )
+        inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        token_embeddings = self.session.run(None, inputs)[0]
+        
+        # Mean pooling over non-padding tokens
+        mask = encoded["attention_mask"][..., np.newaxis].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        
+        # L2 normalization
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents"""
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._embed(texts[start:start + self.batch_size]).tolist())
+        return embeddings
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self._embed([text])[0].tolist()
+
+
+def export_quantized_model(output_dir=ONNX_MODEL_DIR):
+    """
+    Export MiniLM to ONNX and apply dynamic INT8 quantization
+    
+    Args:
+        output_dir: Directory for the quantized model and its tokenizer
+    """
+    # Only needed for the one-off export
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    
+    print(f"Exporting {SOURCE_MODEL_NAME} to ONNX...")
+    model = ORTModelForFeatureExtraction.from_pretrained(SOURCE_MODEL_NAME, export=True)
+    
+    print("Quantizing to INT8...")
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(
+        save_dir=output_dir,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    )
+    AutoTokenizer.from_pretrained(SOURCE_MODEL_NAME).save_pretrained(output_dir)
+    
+    print(f"Saved quantized model to {output_dir}")
+
+def main():
+    export_quantized_model()
+    
+    # Quick check that the exported model loads and produces embeddings
+    embeddings = OnnxEmbeddings()
+    result = embeddings.embed_query("Test query")
+    print(f"ONNX embeddings working: Generated embedding of length {len(result)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,29 @@
 import os
-import json
-from typing import List, Dict, Any
+import re
+import hashlib
+import sqlite3
+import threading
+from collections import deque
+from contextlib import closing
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Any, Optional, Iterable, Iterator
 from dotenv import load_dotenv
+import numpy as np
+import torch
+import chromadb
+from transformers import AutoTokenizer
+from datasketch import MinHash, MinHashLSH
 
 # Import LangChain components
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
 
-# Import our scraper
-from opensim_scraper import OpenSimScraper
+# Import our scraper (and its JSON parser) and the quantized query embeddings
+from opensim_scraper import OpenSimScraper, json_loads
+from onnx_embeddings import OnnxEmbeddings, ONNX_MODEL_DIR, ONNX_MODEL_FILE
 
 # Load environment variables
 load_dotenv()
@@ -18,23 +31,247 @@ load_dotenv()
 # Constants
 EMBEDDINGS_MODEL_NAME = "all-MiniLM-L6-v2"  # A small, free embedding model
 CHROMA_DB_DIR = "opensim_chroma_db"
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+COLLECTION_NAME = "opensim"
+COLLECTION_METADATA = {
+    "hnsw:space": "ip",  # Inner product; all stored and query vectors are unit length
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": 100
+}
+CHUNK_SIZE = 254  # Tokens; the model's 256-token limit minus [CLS] and [SEP]
+CHUNK_OVERLAP = 32  # Tokens
+DEDUP_THRESHOLD = 0.9  # Jaccard similarity above which a chunk is a near-duplicate
+MINHASH_NUM_PERM = 128  # Permutations per MinHash signature
+SHINGLE_SIZE = 5  # Words per shingle
 DATA_DIR = "data"
-DOCS_FILE = "opensim_docs.json"
+DOCS_FILE = "opensim_docs.jsonl"
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite3"  # Chunk embeddings keyed by content hash
+EMBED_BATCH_SIZE = 256  # Chunks per embedding forward pass
+INSERT_BATCH_SIZE = 5000  # Rows per Chroma insert, capped by the client's maximum
+QUERY_CACHE_SIZE = 1024  # Maximum number of cached queries (FIFO eviction)
+QUERY_CACHE_THRESHOLD = 0.95  # Cosine similarity above which a query is a cache hit
+CHAT_HISTORY_SIZE = 32  # Maximum number of messages kept in chat history
+COMPILE_EMBEDDINGS = os.getenv("OPENSIM_COMPILE_EMBEDDINGS") == "1"  # Opt in to torch.compile
+
+def _cpu_has_native_bf16() -> bool:
+    """
+    Check for bfloat16 matmul instructions (AVX512_BF16 or AMX); plain AVX-512
+    CPUs such as Skylake emulate bf16 and run it slower than float32
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next((line.split(":", 1)[1].split() for line in f if line.startswith("flags")), [])
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+# Pick the embedding device and weight precision once at import
+if torch.cuda.is_available():
+    DEVICE, EMBEDDINGS_DTYPE = "cuda", torch.float16
+elif torch.backends.mps.is_available():
+    DEVICE, EMBEDDINGS_DTYPE = "mps", torch.float16
+elif _cpu_has_native_bf16():
+    DEVICE, EMBEDDINGS_DTYPE = "cpu", torch.bfloat16
+else:
+    DEVICE, EMBEDDINGS_DTYPE = "cpu", torch.float32
+
+# Positions where a chunk may end, strongest first: headings, line breaks, then words
+SEPARATORS = [re.compile(r"\n#{2,4} "), re.compile(r"\n"), re.compile(r"\n| ")]
+
+@lru_cache(maxsize=None)
+def _get_tokenizer():
+    """Load the embedding model's tokenizer once per process"""
+    return AutoTokenizer.from_pretrained(f"sentence-transformers/{EMBEDDINGS_MODEL_NAME}")
+
+def fast_split(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Split text into overlapping chunks in a single pass over separator positions
+    
+    The text is tokenized once with the embedding model's tokenizer, and token
+    offsets translate the token budget into character positions, so chunks are
+    never truncated by the model. Each chunk ends at the last heading that fits,
+    else the last line break, else the last word boundary, like
+    RecursiveCharacterTextSplitter.
+    
+    Args:
+        text: Text to split
+        size: Maximum chunk length in tokens
+        overlap: Approximate number of tokens shared by consecutive chunks
+        
+    Returns:
+        List of chunks
+    """
+    offsets = _get_tokenizer()(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)["offset_mapping"]
+    token_starts = [token_start for token_start, _ in offsets]
+    token_ends = [token_end for _, token_end in offsets]
+    cut_levels = [[match.start() for match in sep.finditer(text)] for sep in SEPARATORS]
+    cuts = cut_levels[-1]
+    chunks = []
+    start = 0
+    length = len(text)
+    
+    while start < length:
+        # End at the strongest separator before the first token that does not fit,
+        # or hard-cut at that token if there is none
+        first_token = bisect_right(token_ends, start)
+        if first_token + size >= len(offsets):
+            cut = length
+        else:
+            end = token_starts[first_token + size]
+            cut = end
+            for level in cut_levels:
+                i = bisect_right(level, end) - 1
+                if i >= 0 and level[i] > start:
+                    cut = level[i]
+                    break
+        
+        chunk = text[start:cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        if cut >= length:
+            break
+        
+        # Rewind by the overlap so the next chunk starts on a separator
+        next_start = cut
+        rewind_token = bisect_left(token_starts, cut) - overlap
+        if rewind_token > first_token:
+            i = bisect_left(cuts, token_starts[rewind_token])
+            if i < len(cuts) and cuts[i] < cut:
+                next_start = cuts[i]
+        start = next_start
+    
+    return chunks
+
+def dedupe_chunks(texts: List[str]) -> List[int]:
+    """
+    Find exact and near-duplicate chunks, keeping the first occurrence
+    
+    Args:
+        texts: Chunk texts to filter
+        
+    Returns:
+        Indices of chunks whose text is not within DEDUP_THRESHOLD Jaccard
+        similarity of an earlier chunk
+    """
+    seen_hashes = set()
+    lsh = MinHashLSH(threshold=DEDUP_THRESHOLD, num_perm=MINHASH_NUM_PERM)
+    keep = []
+    
+    for i, text in enumerate(texts):
+        # Cheap exact-duplicate check before computing a signature
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+        if digest in seen_hashes:
+            continue
+        seen_hashes.add(digest)
+        
+        # MinHash over word shingles; short chunks are a single shingle
+        words = text.split()
+        shingles = {
+            " ".join(words[j:j + SHINGLE_SIZE]).encode('utf-8')
+            for j in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+        }
+        minhash = MinHash(num_perm=MINHASH_NUM_PERM)
+        minhash.update_batch(shingles)
+        
+        if lsh.query(minhash):
+            continue
+        lsh.insert(str(i), minhash)
+        keep.append(i)
+    
+    return keep
+
+@lru_cache(maxsize=None)
+def _get_client(path: str = CHROMA_DB_DIR):
+    """Open a Chroma persistent client once per process and reuse it"""
+    return chromadb.PersistentClient(path=path)
+
+def iter_documents(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read scraped documents from a JSONL file one line at a time
+    
+    Args:
+        path: Path to the JSONL documents file
+        
+    Yields:
+        Documents with content and metadata
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield json_loads(line)
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """LangChain embeddings backed by an already loaded SentenceTransformer"""
+    
+    def __init__(self, model: SentenceTransformer):
+        self.model = model
+        
+        # Queries run on worker threads; serialize encode() for the same tokenizer
+        # reason as OnnxEmbeddings
+        self._lock = threading.Lock()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents"""
+        with self._lock:
+            vectors = self.model.encode(
+                texts,
+                batch_size=EMBED_BATCH_SIZE,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            )
+        return vectors.astype(np.float32).tolist()
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query"""
+        return self.embed_documents([text])[0]
 
 class OpenSimRAG:
     """Complete RAG system for OpenSim documentation using Hugging Face"""
     
-    def __init__(self):
-        # Initialize embeddings
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=EMBEDDINGS_MODEL_NAME
-        )
+    def __init__(self, num_threads: Optional[int] = None):
+        # Limit inference threads when several processes share the machine
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        
+        # Embed queries with the INT8 ONNX model when it has been exported
+        # (python onnx_embeddings.py); the PyTorch model is then only loaded if
+        # ingest has chunks to encode
+        self.model = None
+        if os.path.exists(os.path.join(ONNX_MODEL_DIR, ONNX_MODEL_FILE)):
+            self.query_embeddings = OnnxEmbeddings(num_threads=num_threads)
+        else:
+            self.query_embeddings = SentenceTransformerEmbeddings(self._get_model())
+            
+            # Warm up, as OnnxEmbeddings does
+            with torch.inference_mode():
+                self.query_embeddings.embed_query("warmup")
+        
         self.vectorstore = None
-        self.chat_history = []
+        self.chat_history = deque(maxlen=CHAT_HISTORY_SIZE)
+        
+        # Guards chat history and the query cache when queries run on worker threads
+        self._lock = threading.Lock()
+        
+        # Semantic query cache: a ring buffer of normalized query embeddings, the k they
+        # were retrieved with and their documents
+        self._clear_query_cache()
         
-    def collect_documents(self, max_pages=50, use_cached=True):
+    def _get_model(self) -> SentenceTransformer:
+        """Load the PyTorch embedding model on first use"""
+        if self.model is None:
+            self.model = SentenceTransformer(
+                EMBEDDINGS_MODEL_NAME,
+                device=DEVICE,
+                model_kwargs={"torch_dtype": EMBEDDINGS_DTYPE}
+            )
+            
+            # Inference only; compiling is opt-in because the first call pays the compile time
+            self.model.eval()
+            if COMPILE_EMBEDDINGS:
+                self.model.compile(dynamic=True)
+        return self.model
+    
+    def collect_documents(self, max_pages=50, use_cached=True) -> Iterator[Dict[str, Any]]:
         """
         Collect documents from OpenSim website
         
@@ -43,92 +280,204 @@ class OpenSimRAG:
             use_cached: Whether to use cached documents if available
         
         Returns:
-            List of documents
+            Iterator over documents, read lazily from disk
         """
         docs_path = os.path.join(DATA_DIR, DOCS_FILE)
         
         # Check if we can use cached documents
         if use_cached and os.path.exists(docs_path):
             print(f"Loading cached documents from {docs_path}")
-            with open(docs_path, 'r', encoding='utf-8') as f:
-                documents = json.load(f)
-            print(f"Loaded {len(documents)} documents")
-            return documents
+        else:
+            # Scrape documents; the scraper streams them to docs_path
+            print("Scraping documents from OpenSim website...")
+            scraper = OpenSimScraper(output_dir=DATA_DIR)
+            scraper.scrape(max_pages=max_pages)
         
-        # Scrape documents
-        print("Scraping documents from OpenSim website...")
-        scraper = OpenSimScraper(output_dir=DATA_DIR)
-        documents = scraper.scrape(max_pages=max_pages)
-        return documents
+        return iter_documents(docs_path)
     
-    def create_vector_database(self, documents: List[Dict[str, Any]], force_recreate=False):
+    def create_vector_database(self, documents: Iterable[Dict[str, Any]], force_recreate=False):
         """
         Create and persist vector database from documents
         
         Args:
-            documents: List of documents with content and metadata
+            documents: Documents with content and metadata; may be a one-shot iterator
             force_recreate: Whether to recreate the database even if it exists
         """
         # Check if database already exists
-        if os.path.exists(CHROMA_DB_DIR) and not force_recreate:
+        if self.has_vector_database() and not force_recreate:
             print(f"Vector database already exists at {CHROMA_DB_DIR}")
             self.load_vector_database()
             return
         
         print("Creating new vector database...")
         
-        # Convert to LangChain Document format
-        langchain_docs = []
+        # Split documents as they are read into parallel text and metadata lists
+        texts = []
+        metadatas = []
+        num_documents = 0
         for doc in documents:
-            langchain_docs.append(
-                Document(
-                    page_content=doc["content"],
-                    metadata=doc["metadata"]
-                )
-            )
+            num_documents += 1
+            chunks = fast_split(doc["content"])
+            texts.extend(chunks)
+            metadatas.extend([doc["metadata"]] * len(chunks))
+        print(f"Split {num_documents} documents into {len(texts)} chunks")
+        
+        # Boilerplate shared between pages (navigation, footers) would otherwise be embedded repeatedly
+        keep = dedupe_chunks(texts)
+        print(f"Removed {len(texts) - len(keep)} duplicate chunks")
+        texts = [texts[i] for i in keep]
+        metadatas = [metadatas[i] for i in keep]
         
-        # Create text splitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            separators=["\n## ", "\n### ", "\n#### ", "\n", " ", ""]
+        # Embed chunks, reusing vectors from earlier builds where the text is unchanged
+        vectors = self._embed_chunks(texts)
+        
+        # Create the collection, replacing any previous one
+        client = _get_client(CHROMA_DB_DIR)
+        if COLLECTION_NAME in client.list_collections():
+            client.delete_collection(COLLECTION_NAME)
+        collection = client.get_or_create_collection(
+            COLLECTION_NAME,
+            metadata=COLLECTION_METADATA
         )
         
-        # Split documents
-        splits = text_splitter.split_documents(langchain_docs)
-        print(f"Split {len(langchain_docs)} documents into {len(splits)} chunks")
+        # Insert the precomputed vectors in large slices; each add is one SQLite transaction
+        batch_size = min(INSERT_BATCH_SIZE, client.get_max_batch_size())
+        for start in range(0, len(texts), batch_size):
+            end = min(start + batch_size, len(texts))
+            collection.add(
+                ids=[str(i) for i in range(start, end)],
+                embeddings=vectors[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
         
-        # Create vector store
-        self.vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=self.embeddings,
-            persist_directory=CHROMA_DB_DIR
+        # The LangChain wrapper is only used for query-time search
+        self.vectorstore = Chroma(
+            client=client,
+            collection_name=COLLECTION_NAME,
+            embedding_function=self.query_embeddings,
+            collection_metadata=COLLECTION_METADATA
         )
+        self._clear_query_cache()
+        print(f"Vector database created with {len(texts)} chunks and persisted to {CHROMA_DB_DIR}")
+    
+    def _embed_chunks(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed chunks through the on-disk embedding cache
+        
+        Only chunks missing from the cache are encoded, in one batched pass with the
+        underlying SentenceTransformer. Vectors are cached as float16.
+        
+        Args:
+            texts: Chunk texts to embed
+            
+        Returns:
+            Normalized float32 embeddings, one row per text
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        # Key on the model, device and precision as well as the text, so vectors computed
+        # in float16, bfloat16 or float32 are never mixed within one index
+        key_prefix = f"{EMBEDDINGS_MODEL_NAME}\0{DEVICE}\0{EMBEDDINGS_DTYPE}\0"
+        keys = [
+            hashlib.blake2b(f"{key_prefix}{text}".encode('utf-8'), digest_size=16).digest()
+            for text in texts
+        ]
+        
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with closing(sqlite3.connect(os.path.join(DATA_DIR, EMBEDDING_CACHE_FILE))) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            
+            cached = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+                cached.update(rows)
+            
+            missing = [i for i, key in enumerate(keys) if key not in cached]
+            print(f"Embedding {len(missing)} new chunks ({len(texts) - len(missing)} cached)")
+            
+            if missing:
+                with torch.inference_mode():
+                    new_vectors = self._get_model().encode(
+                        [texts[i] for i in missing],
+                        batch_size=EMBED_BATCH_SIZE,
+                        show_progress_bar=True,
+                        convert_to_numpy=True
+                    )
+                
+                # Upcast half-precision output before normalizing to avoid rounding errors
+                new_vectors = new_vectors.astype(np.float32)
+                new_vectors /= np.maximum(np.linalg.norm(new_vectors, axis=1, keepdims=True), 1e-12)
+                
+                new_rows = [
+                    (keys[i], vector.astype(np.float16).tobytes())
+                    for i, vector in zip(missing, new_vectors)
+                ]
+                conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", new_rows)
+                cached.update(new_rows)
         
-        # Persist to disk
-        self.vectorstore.persist()
-        print(f"Vector database created with {len(splits)} chunks and persisted to {CHROMA_DB_DIR}")
+        # Reassemble in the original order and renormalize after the float16 round trip
+        vectors = np.stack([np.frombuffer(cached[key], dtype=np.float16) for key in keys]).astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+    
+    def has_vector_database(self) -> bool:
+        """
+        Check whether a vector database with chunks in the expected collection exists
+        
+        Returns:
+            False if there is no database, or if it was built by an older version that
+            kept its chunks in LangChain's default "langchain" collection
+        """
+        if not os.path.exists(CHROMA_DB_DIR):
+            return False
+        
+        client = _get_client(CHROMA_DB_DIR)
+        return (COLLECTION_NAME in client.list_collections()
+                and client.get_collection(COLLECTION_NAME).count() > 0)
     
     def load_vector_database(self):
         """
         Load existing vector database
         """
-        if os.path.exists(CHROMA_DB_DIR):
+        if self.has_vector_database():
             self.vectorstore = Chroma(
-                persist_directory=CHROMA_DB_DIR,
-                embedding_function=self.embeddings
+                client=_get_client(CHROMA_DB_DIR),
+                collection_name=COLLECTION_NAME,
+                embedding_function=self.query_embeddings,
+                collection_metadata=COLLECTION_METADATA
             )
+            self._prefetch_vector_database()
             print(f"Loaded vector database from {CHROMA_DB_DIR}")
         else:
-            print(f"No existing vector database found at {CHROMA_DB_DIR}")
+            print(f"No '{COLLECTION_NAME}' collection with data found in {CHROMA_DB_DIR}")
+    
+    def _prefetch_vector_database(self):
+        """
+        Ask the kernel to read the persisted SQLite and HNSW files into the page cache
+        so the first query does not wait on cold disk reads
+        """
+        if not hasattr(os, "posix_fadvise"):
+            return
+        
+        for root, _, files in os.walk(CHROMA_DB_DIR):
+            for name in files:
+                with open(os.path.join(root, name), "rb") as f:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
     
-    def process_query(self, query: str, k: int = 4) -> Dict[str, Any]:
+    def process_query(self, query: str, k: int = 4, record_history: bool = True) -> Dict[str, Any]:
         """
         Process a user query and return relevant documents
         
         Args:
             query: The user's question about OpenSim
             k: Number of documents to retrieve
+            record_history: Whether to add the query and answer to the chat history
             
         Returns:
             Dictionary with relevant documents
@@ -140,11 +489,8 @@ class OpenSimRAG:
         if self.vectorstore is None:
             return {"answer": "No knowledge base available. Please add documents first.", "sources": []}
         
-        # Add query to chat history
-        self.chat_history.append({"role": "user", "content": query})
-        
         # Get relevant documents
-        docs = self.vectorstore.similarity_search(query, k=k)
+        docs = self._retrieve(query, k)
         
         # For now, without an LLM, we'll just return the most relevant document
         if docs:
@@ -154,27 +500,119 @@ class OpenSimRAG:
             answer = "I couldn't find any relevant information about that topic."
         
         # Add to chat history
-        self.chat_history.append({"role": "assistant", "content": answer})
+        if record_history:
+            with self._lock:
+                self.chat_history.append({"role": "user", "content": query})
+                self.chat_history.append({"role": "assistant", "content": answer})
+        
+        # Collect sources, keeping only the first chunk from each page
+        sources = {}
+        for doc in docs:
+            metadata = doc.metadata
+            source = metadata.get("source", "Unknown")
+            if source not in sources:
+                sources[source] = {
+                    "title": metadata.get("title", "Unknown"),
+                    "source": source,
+                    "section": metadata.get("section", "Unknown"),
+                    "type": metadata.get("type", "Unknown")
+                }
         
         # Format the response
         response = {
             "answer": answer,
-            "sources": [
-                {
-                    "title": doc.metadata.get("title", "Unknown"),
-                    "source": doc.metadata.get("source", "Unknown"),
-                    "section": doc.metadata.get("section", "Unknown"),
-                    "type": doc.metadata.get("type", "Unknown")
-                }
-                for doc in docs
-            ]
+            "sources": list(sources.values())
         }
         
         return response
     
+    def warm_cache(self, queries: List[str], k: int = 4):
+        """
+        Pre-compute retrieval results for common queries
+        
+        Args:
+            queries: Queries to add to the semantic cache
+            k: Number of documents to retrieve per query
+        """
+        if self.vectorstore is None:
+            return
+        
+        for query in queries:
+            self._retrieve(query, k)
+        print(f"Warmed query cache with {len(queries)} queries")
+    
+    def _retrieve(self, query: str, k: int) -> List[Document]:
+        """
+        Retrieve relevant documents, using the semantic cache when possible
+        
+        Args:
+            query: The user's question about OpenSim
+            k: Number of documents to retrieve
+            
+        Returns:
+            List of relevant documents
+        """
+        # Embed the query once and reuse the vector for the cache lookup and the search
+        with torch.inference_mode():
+            query_vec = np.asarray(self.query_embeddings.embed_query(query), dtype=np.float32)
+        query_vec /= np.linalg.norm(query_vec) or 1.0
+        
+        docs = self._lookup_query_cache(query_vec, k)
+        if docs is None:
+            docs = self.vectorstore.similarity_search_by_vector(query_vec.tolist(), k=k)
+            self._store_query_cache(query_vec, k, docs)
+        return docs
+    
+    def _lookup_query_cache(self, query_vec: np.ndarray, k: int) -> Optional[List[Document]]:
+        """
+        Find cached documents for a semantically similar query
+        
+        Args:
+            query_vec: L2-normalized query embedding
+            k: Number of documents requested
+            
+        Returns:
+            Cached documents, or None on a cache miss
+        """
+        with self._lock:
+            if not self._qcache_size:
+                return None
+            
+            # Only entries retrieved with the same k can answer this query
+            sims = self._qcache_vecs[:self._qcache_size] @ query_vec
+            sims[self._qcache_ks[:self._qcache_size] != k] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] > QUERY_CACHE_THRESHOLD:
+                return self._qcache_docs[best]
+        return None
+    
+    def _store_query_cache(self, query_vec: np.ndarray, k: int, docs: List[Document]):
+        """Add a query embedding and its retrieved documents to the semantic cache"""
+        with self._lock:
+            if self._qcache_vecs is None:
+                self._qcache_vecs = np.empty((QUERY_CACHE_SIZE, query_vec.shape[0]), dtype=np.float32)
+            
+            # Overwrite the oldest slot once the buffer is full
+            slot = self._qcache_next
+            self._qcache_vecs[slot] = query_vec
+            self._qcache_ks[slot] = k
+            self._qcache_docs[slot] = docs
+            self._qcache_next = (slot + 1) % QUERY_CACHE_SIZE
+            self._qcache_size = min(self._qcache_size + 1, QUERY_CACHE_SIZE)
+    
+    def _clear_query_cache(self):
+        """Drop all cached query results, e.g. after the vector database changes"""
+        with self._lock:
+            self._qcache_vecs = None  # Allocated on first store, once the dimension is known
+            self._qcache_ks = np.zeros(QUERY_CACHE_SIZE, dtype=np.int64)
+            self._qcache_docs = [None] * QUERY_CACHE_SIZE
+            self._qcache_size = 0
+            self._qcache_next = 0
+    
     def clear_chat_history(self):
         """Clear the chat history"""
-        self.chat_history = []
+        with self._lock:
+            self.chat_history.clear()
         print("Chat history cleared")
 
 
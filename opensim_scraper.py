@@ -1,15 +1,56 @@
 import os
+import gzip
+import hashlib
 import requests
 import time
-from bs4 import BeautifulSoup
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import lxml.html
+from lxml.cssselect import CSSSelector
+from lxml.etree import XPath
 from urllib.parse import urljoin, urlparse
-import json
 from typing import List, Dict, Any, Set
 import re
 
+# orjson reads and writes UTF-8 bytes directly; fall back to the stdlib if it is missing
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    import json
+    from json import loads as json_loads
+    
+    def json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+DOCS_FILE = "opensim_docs.jsonl"  # One JSON document per line
+MAX_WORKERS = 8  # Concurrent page fetches
+REQUEST_DELAY = 1.0  # Minimum seconds between requests to the same host
+
 class OpenSimScraper:
     """Scraper for OpenSim documentation"""
     
+    # Selectors and patterns are compiled once rather than on every page.
+    # Common content containers, in order of preference; this is site-specific
+    # and might need adjustments
+    _CONTENT_SELECTORS = [
+        CSSSelector(selector) for selector in [
+            'div.wiki-content',
+            'div.main-content',
+            'article',
+            'div.content',
+            'div.documentation',
+            'div#content',
+            'div.confluenceContent'
+        ]
+    ]
+    _CLEAN_SELECTOR = CSSSelector('nav, header, footer, .sidebar, .navigation, .menu, script, style, .hidden')
+    _LINK_XPATH = XPath('//a/@href')
+    _NEWLINE_RE = re.compile(r'\n{3,}')
+    _CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+    _SKIP_EXTS = ('.pdf', '.zip', '.exe', '.dmg')
+    
     def __init__(self, base_urls=None, output_dir="data"):
         # Default OpenSim documentation URLs
         self.base_urls = base_urls or [
@@ -20,87 +61,170 @@ class OpenSimScraper:
         
         self.output_dir = output_dir
         self.visited_urls = set()
-        self.documents = []
-        
-        # Ensure output directory exists
-        os.makedirs(output_dir, exist_ok=True)
+        self.document_count = 0
+        self._docs_file = None
+        
+        # Shared connection pool for all worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=2 * MAX_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # Guards the documents file and per-host request times
+        self._lock = threading.Lock()
+        self._next_request_time = {}
+        
+        # Ensure output and page cache directories exist
+        self.cache_dir = os.path.join(output_dir, "html_cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
     
-    def scrape(self, max_pages=50):
+    def scrape(self, max_pages=50, max_depth=3):
         """
         Scrape OpenSim documentation
         
         Args:
             max_pages: Maximum number of pages to scrape
+            max_depth: Maximum link depth from the base URLs
         """
         print(f"Starting to scrape OpenSim documentation (max {max_pages} pages)...")
         
-        for base_url in self.base_urls:
-            self._scrape_from_url(base_url, max_pages=max_pages)
+        # Documents are written to disk as they are found rather than kept in memory,
+        # and replace the previous file only once the crawl has finished
+        docs_path = os.path.join(self.output_dir, DOCS_FILE)
+        self._docs_file = open(f"{docs_path}.tmp", 'wb')
+        
+        # Breadth-first crawl; each wave of queued pages is fetched concurrently
+        queue = deque((url, 0) for url in self.base_urls)
         
-        print(f"Scraping completed. Collected {len(self.documents)} documents.")
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                while queue and len(self.visited_urls) < max_pages:
+                    batch = []
+                    while queue and len(self.visited_urls) < max_pages:
+                        url, depth = queue.popleft()
+                        if depth > max_depth or url in self.visited_urls:
+                            continue
+                        self.visited_urls.add(url)
+                        batch.append((url, depth))
+                    
+                    urls = [url for url, _ in batch]
+                    for (url, depth), links in zip(batch, executor.map(self._scrape_page, urls)):
+                        queue.extend((link, depth + 1) for link in links)
+            
+            print(f"Scraping completed. Collected {self.document_count} documents.")
+        except BaseException:
+            # An aborted crawl keeps the previous documents
+            self._docs_file.close()
+            os.remove(self._docs_file.name)
+            raise
         
         # Save the collected documents
-        self._save_documents()
+        self._save_documents(docs_path)
         
-        return self.documents
+        return self.document_count
     
-    def _scrape_from_url(self, url, depth=0, max_depth=3, max_pages=50):
+    def _scrape_page(self, url):
         """
-        Recursively scrape from a URL
+        Scrape a single page
         
         Args:
             url: URL to scrape
-            depth: Current recursion depth
-            max_depth: Maximum recursion depth
-            max_pages: Maximum number of pages to scrape
-        """
-        # Check if we've reached the limits
-        if depth > max_depth or len(self.visited_urls) >= max_pages or url in self.visited_urls:
-            return
-        
-        # Add to visited URLs
-        self.visited_urls.add(url)
         
+        Returns:
+            List of URLs linked from the page
+        """
         print(f"Scraping: {url}")
         
         try:
-            # Implement polite scraping with delays
-            time.sleep(1)
-            
-            # Get the page content
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
+            # Get the page content, from the disk cache if it was fetched before
+            cache_path = self._cache_path(url)
+            content_type = ''
+            if os.path.exists(cache_path):
+                with gzip.open(cache_path, 'rb') as f:
+                    content = f.read()
+            else:
+                # Implement polite scraping with per-host delays
+                self._wait_for_host(url)
+                
+                response = self.session.get(url, timeout=10)
+                response.raise_for_status()
+                content = response.content
+                content_type = response.headers.get('Content-Type', '')
+                
+                # Write to a temporary file first so a crash never leaves a truncated entry
+                tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+                with gzip.open(tmp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, cache_path)
             
-            # Parse the page
-            soup = BeautifulSoup(response.text, 'html.parser')
+            # Parse the raw bytes once into an lxml tree
+            encoding = self._detect_encoding(content, content_type)
+            parser = lxml.html.HTMLParser(encoding=encoding) if encoding else None
+            tree = lxml.html.fromstring(content, parser=parser)
             
             # Process the page content
-            self._process_page(url, soup)
+            self._process_page(url, tree)
             
             # Find links to follow
-            links = self._extract_links(url, soup)
-            
-            # Follow the links recursively
-            for link in links:
-                if len(self.visited_urls) < max_pages:
-                    self._scrape_from_url(link, depth + 1, max_depth, max_pages)
+            return self._extract_links(url, tree)
         
         except Exception as e:
             print(f"Error scraping {url}: {e}")
+            return []
+    
+    def _detect_encoding(self, content, content_type):
+        """
+        Pick the encoding to parse a page with, without requests' charset guessing
+        
+        Args:
+            content: Raw page bytes
+            content_type: Content-Type header, empty for pages read from the cache
+        
+        Returns:
+            The declared charset, 'utf-8' for valid UTF-8 bytes, or None to let lxml
+            detect it from the BOM or <meta> tag
+        """
+        match = self._CHARSET_RE.search(content_type)
+        if match:
+            return match.group(1)
+        
+        # A strict decode is a fast C-level check, and keeps cached pages, which
+        # have no headers, parsing the same way as freshly fetched ones
+        try:
+            content.decode('utf-8')
+            return 'utf-8'
+        except UnicodeDecodeError:
+            return None
+    
+    def _cache_path(self, url):
+        """Path of the gzipped page cache entry for a URL"""
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + ".html.gz")
     
-    def _process_page(self, url, soup):
+    def _wait_for_host(self, url):
+        """Sleep until REQUEST_DELAY has passed since the last request reserved for this host"""
+        host = urlparse(url).netloc
+        
+        with self._lock:
+            now = time.monotonic()
+            request_time = max(now, self._next_request_time.get(host, now))
+            self._next_request_time[host] = request_time + REQUEST_DELAY
+        
+        if request_time > now:
+            time.sleep(request_time - now)
+    
+    def _process_page(self, url, tree):
         """
         Process a page and extract content
         
         Args:
             url: URL of the page
-            soup: BeautifulSoup object of the page
+            tree: lxml HTML tree of the page
         """
         # Extract title
-        title = self._extract_title(soup)
+        title = self._extract_title(tree)
         
         # Extract content
-        content = self._extract_content(soup)
+        content = self._extract_content(tree)
         
         if not content:
             return
@@ -120,85 +244,76 @@ class OpenSimScraper:
             }
         }
         
-        # Add to documents
-        self.documents.append(document)
+        # Append to the documents file; flushing keeps it usable if the crawl is interrupted
+        with self._lock:
+            self._docs_file.write(json_dumps(document) + b"\n")
+            self._docs_file.flush()
+            self.document_count += 1
         
         print(f"Added document: {title} ({content_type})")
     
-    def _extract_title(self, soup):
-        """Extract title from BeautifulSoup object"""
+    def _extract_title(self, tree):
+        """Extract title from an lxml HTML tree"""
         # Try different approaches for finding the title
-        if soup.title and soup.title.string:
-            return soup.title.string.strip()
+        title = tree.findtext('.//title')
+        if title and title.strip():
+            return title.strip()
         
         # Look for main heading
         for heading in ['h1', 'h2', 'h3']:
-            if soup.find(heading):
-                return soup.find(heading).get_text().strip()
+            element = tree.find(f'.//{heading}')
+            if element is not None:
+                return element.text_content().strip()
         
         return "Unknown Title"
     
-    def _extract_content(self, soup):
-        """Extract main content from BeautifulSoup object"""
+    def _extract_content(self, tree):
+        """Extract main content from an lxml HTML tree"""
         # Try to find the main content
-        # This is site-specific and might need adjustments
-        
-        # Identify common content containers
-        content_selectors = [
-            'div.wiki-content', 
-            'div.main-content',
-            'article',
-            'div.content',
-            'div.documentation',
-            'div#content',
-            'div.confluenceContent'
-        ]
-        
         content = None
         
         # Try each selector
-        for selector in content_selectors:
-            content_element = soup.select_one(selector)
-            if content_element:
-                content = content_element
+        for selector in self._CONTENT_SELECTORS:
+            matches = selector(tree)
+            if matches:
+                content = matches[0]
                 break
         
         # If we couldn't find a content container, use the body
-        if not content:
-            content = soup.find('body')
+        if content is None:
+            content = tree.find('.//body')
         
-        if not content:
+        if content is None:
             return ""
         
         # Remove navigation, headers, footers, etc.
-        for element in content.select('nav, header, footer, .sidebar, .navigation, .menu, script, style, .hidden'):
-            element.decompose()
+        for element in self._CLEAN_SELECTOR(content):
+            element.drop_tree()
         
-        # Get the text content
-        text = content.get_text(separator='\n', strip=True)
+        # Get the text content, one stripped string per line
+        text = '\n'.join(part.strip() for part in content.itertext() if part.strip())
         
         # Clean up the text
-        text = re.sub(r'\n{3,}', '\n\n', text)  # Remove excessive newlines
+        text = self._NEWLINE_RE.sub('\n\n', text)  # Remove excessive newlines
         
         return text
     
-    def _extract_links(self, base_url, soup):
+    def _extract_links(self, base_url, tree):
         """
         Extract relevant links to follow
         
         Args:
             base_url: Base URL for resolving relative links
-            soup: BeautifulSoup object
+            tree: lxml HTML tree
         
         Returns:
             List of URLs to follow
         """
         links = []
+        base_netloc = urlparse(base_url).netloc
         
         # Extract all links
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href']
-            
+        for href in self._LINK_XPATH(tree):
             # Skip empty links, anchors, javascript, etc.
             if not href or href.startswith('#') or href.startswith('javascript:'):
                 continue
@@ -207,14 +322,11 @@ class OpenSimScraper:
             full_url = urljoin(base_url, href)
             
             # Skip external links or non-documentation links
-            parsed_url = urlparse(full_url)
-            base_parsed = urlparse(base_url)
-            
-            if parsed_url.netloc != base_parsed.netloc:
+            if urlparse(full_url).netloc != base_netloc:
                 continue
             
             # Skip links to files (e.g., .pdf, .zip)
-            if any(full_url.endswith(ext) for ext in ['.pdf', '.zip', '.exe', '.dmg']):
+            if full_url.endswith(self._SKIP_EXTS):
                 continue
             
             # Add the link if we haven't visited it yet
@@ -258,23 +370,26 @@ class OpenSimScraper:
         # Fallback to a generic section name
         return "General"
     
-    def _save_documents(self):
-        """Save the collected documents to JSON"""
-        output_file = os.path.join(self.output_dir, "opensim_docs.json")
+    def _save_documents(self, path):
+        """
+        Close the JSONL documents file and move it into place
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(self.documents, f, ensure_ascii=False, indent=2)
+        Args:
+            path: Final path of the documents file
+        """
+        self._docs_file.close()
+        os.replace(self._docs_file.name, path)
         
-        print(f"Saved {len(self.documents)} documents to {output_file}")
+        print(f"Saved {self.document_count} documents to {path}")
 
 def main():
     # Create scraper
     scraper = OpenSimScraper()
     
     # Start scraping
-    documents = scraper.scrape(max_pages=20)  # Limit to 20 pages for testing
+    document_count = scraper.scrape(max_pages=20)  # Limit to 20 pages for testing
     
-    print(f"Collected {len(documents)} documents.")
+    print(f"Collected {document_count} documents.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,6 @@
 import os
 import sys
 from dotenv import load_dotenv
-import numpy as np
 
 # Load environment variables
 load_dotenv()
@@ -12,6 +11,7 @@ print("Testing Hugging Face setup...")
 try:
     from langchain_core.prompts import PromptTemplate
     from langchain_huggingface import HuggingFaceEmbeddings
+    from huggingface_hub import try_to_load_from_cache
     print("LangChain imports successful")
 except ImportError as e:
     print(f"Error importing LangChain components: {e}")
@@ -19,9 +19,15 @@ except ImportError as e:
 
 # Test Hugging Face embeddings
 try:
-    # This uses a small, free model for embeddings
+    # This uses a small, free model for embeddings, from the same default Hugging Face
+    # cache as OpenSimRAG; with HF_OFFLINE=1 and the model already cached, skip the Hub
+    model_cached = isinstance(
+        try_to_load_from_cache("sentence-transformers/all-MiniLM-L6-v2", "config.json"), str
+    )
+    local_files_only = os.environ.get("HF_OFFLINE") == "1" and model_cached
     embeddings = HuggingFaceEmbeddings(
-        model_name="all-MiniLM-L6-v2"
+        model_name="all-MiniLM-L6-v2",
+        model_kwargs={"local_files_only": local_files_only}
     )
     result = embeddings.embed_query("Test query")
     print(f"Hugging Face embeddings working: Generated embedding of length {len(result)}")